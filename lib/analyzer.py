@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 from . import config
 
@@ -24,39 +25,51 @@ def analyze_transfers(df: pd.DataFrame) -> pd.DataFrame:
     df["is_transfer"] = False
     df["transfer_to"] = None
     
-    # 出金データと入金データを分離
-    out_df = df[df["amount_out"] > 0].copy()
-    in_df = df[df["amount_in"] > 0].copy()
-    
-    # シンプルな総当たりに近いマッチング（データ量少ない前提）
-    # 出金レコード毎に、近接日付の入金を探索
-    for idx_out, row_out in out_df.iterrows():
-        target_amount = row_out["amount_out"]
-        target_date = row_out["date"]
-        source_account = row_out["account_id"]
-        
-        # 候補検索: 口座が異なり、金額が近似、日付が近い
-        candidates = in_df[
-            (in_df["account_id"] != source_account) &
-            (in_df["amount_in"] >= target_amount - config.TRANSFER_AMOUNT_TOLERANCE) &
-            (in_df["amount_in"] <= target_amount + config.TRANSFER_AMOUNT_TOLERANCE) &
-            ((in_df["date"] - target_date).abs().dt.days <= config.TRANSFER_DAYS_WINDOW)
+    # 出金行と入金行の位置を分離
+    out_idx = np.flatnonzero((df["amount_out"] > 0).to_numpy())
+    in_idx = np.flatnonzero((df["amount_in"] > 0).to_numpy())
+
+    if len(out_idx) == 0 or len(in_idx) == 0:
+        return df
+
+    # ホットループから文字列比較とTimestamp演算を外すため、
+    # 口座IDは整数コードへ、日付は日数の整数へ一度だけ変換しておく
+    acc_codes = pd.factorize(df["account_id"])[0]
+    day_ords = df["date"].to_numpy().astype("datetime64[D]").astype(np.int64)
+
+    in_days = day_ords[in_idx]  # dfは日付昇順ソート済みなので昇順
+    in_amounts = df["amount_in"].to_numpy()[in_idx]
+    out_amounts = df["amount_out"].to_numpy()[out_idx]
+
+    tolerance = config.TRANSFER_AMOUNT_TOLERANCE
+    window = config.TRANSFER_DAYS_WINDOW
+
+    # 出金レコード毎に、±検出窓にかかる入金行だけを二分探索で切り出して照合する
+    # （旧実装は出金行ごとに入金全行のboolマスクを作り直していた）
+    matches = []
+    for i, pos_out in enumerate(out_idx):
+        lo = np.searchsorted(in_days, day_ords[pos_out] - window, side="left")
+        hi = np.searchsorted(in_days, day_ords[pos_out] + window, side="right")
+        if lo == hi:
+            continue
+
+        # 候補条件: 口座が異なり、金額が近似（日付は切り出し済み）
+        candidates = in_idx[lo:hi][
+            (acc_codes[in_idx[lo:hi]] != acc_codes[pos_out])
+            & (in_amounts[lo:hi] >= out_amounts[i] - tolerance)
+            & (in_amounts[lo:hi] <= out_amounts[i] + tolerance)
         ]
-        
-        if not candidates.empty:
+        if len(candidates):
             # マッチした相手（最初の1件だけ採用する簡易ロジック）
-            match = candidates.iloc[0]
-            
-            # フラグ更新
-            # 元のdfのインデックスを参照するために、indexを保持しておく必要があるが
-            # ここでは簡易的に処理。実際はGlobal ID的キーがあると良い。
-            # pandasのindexが生きていればそれを使う
-            
-            df.at[idx_out, "is_transfer"] = True
-            df.at[idx_out, "transfer_to"] = f"{match['account_id']} ({match['date'].date()})"
-            
-            # 相手方も更新（重複マッチのリスクはあるが許容）
-            df.at[match.name, "is_transfer"] = True
-            df.at[match.name, "transfer_to"] = f"{source_account} ({target_date.date()})"
-            
+            matches.append((pos_out, candidates[0]))
+
+    # フラグ更新はマッチしたペアに対してだけ行う
+    # （相手方の重複マッチのリスクはあるが旧実装同様に許容＝後勝ち）
+    for pos_out, pos_in in matches:
+        df.at[pos_out, "is_transfer"] = True
+        df.at[pos_out, "transfer_to"] = f"{df.at[pos_in, 'account_id']} ({df.at[pos_in, 'date'].date()})"
+
+        df.at[pos_in, "is_transfer"] = True
+        df.at[pos_in, "transfer_to"] = f"{df.at[pos_out, 'account_id']} ({df.at[pos_out, 'date'].date()})"
+
     return df
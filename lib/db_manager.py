@@ -39,40 +39,83 @@ def init_db(case_name: str):
     conn.commit()
     conn.close()
 
-def save_transactions(case_name: str, df: pd.DataFrame):
+def save_transactions(case_name: str, df: pd.DataFrame, mode: str = "replace"):
+    """
+    取引データを保存する
+    mode="replace": 既存データを削除して洗い替え（シンプル運用のため）
+    mode="append":  既存データを残して末尾に追記（インポート時の差分保存用）
+    """
     db_path = get_case_db_path(case_name)
     conn = sqlite3.connect(db_path)
     conn.text_factory = str  # UTF-8対応
 
-    # 既存データを削除して洗い替え（シンプル運用のため）
-    # 本番運用では追記ロジックなどを検討
     cursor = conn.cursor()
-    
+
     # migration: categoryカラムがない場合は追加（保存前チェック）
     try:
         cursor.execute("SELECT category FROM transactions LIMIT 1")
     except sqlite3.OperationalError:
         cursor.execute("ALTER TABLE transactions ADD COLUMN category TEXT")
 
-    cursor.execute("DELETE FROM transactions") # 全件削除
+    if mode == "replace":
+        cursor.execute("DELETE FROM transactions") # 全件削除
 
     df.to_sql("transactions", conn, if_exists="append", index=False)
     conn.commit()
     conn.close()
 
-def load_transactions(case_name: str) -> pd.DataFrame:
+def update_transfer_flags(case_name: str, df: pd.DataFrame) -> bool:
+    """既存取引の資金移動フラグをidで対応づけて更新する（追記保存時の差分更新用）"""
+    db_path = get_case_db_path(case_name)
+    if not os.path.exists(db_path) or df.empty:
+        return False
+
+    try:
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+        cursor.executemany("""
+            UPDATE transactions
+            SET is_transfer = ?, transfer_to = ?
+            WHERE id = ?
+        """, [
+            (bool(row.is_transfer), row.transfer_to, int(row.id))
+            for row in df[["is_transfer", "transfer_to", "id"]].itertuples(index=False)
+        ])
+        conn.commit()
+        conn.close()
+        return True
+    except Exception as e:
+        print(f"資金移動フラグ更新エラー: {e}")
+        return False
+
+def load_transactions(case_name: str, columns: list[str] | None = None) -> pd.DataFrame:
+    """
+    取引データを読み込む
+    columns指定時は必要カラムだけをSELECTする（SQLiteのデコードと
+    pandasへの変換コストはカラム数に比例するため、表示用途では絞って読む）
+    """
     db_path = get_case_db_path(case_name)
     if not os.path.exists(db_path):
         return pd.DataFrame()
 
     conn = sqlite3.connect(db_path)
     conn.text_factory = str  # UTF-8対応
-    df = pd.read_sql("SELECT * FROM transactions", conn)
+
+    col_sql = "*"
+    if columns:
+        # migration前のDBにはcategoryカラムがない等があるため、実在するカラムに絞る
+        existing = {row[1] for row in conn.execute("PRAGMA table_info(transactions)")}
+        selected = [c for c in columns if c in existing]
+        if selected:
+            col_sql = ", ".join(selected)
+
+    df = pd.read_sql(f"SELECT {col_sql} FROM transactions", conn)
     conn.close()
 
     # 日付カラムをdatetime型に変換
+    # cache=True: 通帳データは同じ日付が多いため、ユニーク日付だけパースされる
     if 'date' in df.columns and len(df) > 0:
-        df['date'] = pd.to_datetime(df['date'], errors='coerce')
+        df['date'] = pd.to_datetime(df['date'], errors='coerce', cache=True)
 
     return df
 
@@ -1,23 +1,27 @@
+import numpy as np
 import pandas as pd
 import polars as pl
 from typing import Optional
 
-def load_csv(file) -> pd.DataFrame:
+def load_csv(file) -> tuple[pd.DataFrame, dict]:
     """
     OCR済みCSVを読み込み、標準フォーマットに変換する
     想定CSVカラム: 銀行名,年月日,摘要,払戻,お預り,差引残高
     または: 銀行名,支店名,口座番号,年月日,摘要,払戻,お預り,差引残高
+
+    戻り値は (DataFrame, CSVから読み取ったメタデータdict) のタプル。
+    （df.attrsはrename/concat等で黙って消えるため使わない）
     """
     # Polarsで高速読み込み
+    # 変換はPolars側の式でまとめて行い、pandasへの変換は最後に1回だけにする
     try:
         df_pl = pl.read_csv(file, encoding="utf-8-sig") # 典型的なShift-JIS/UTF-8 with BOM対策
-        df = df_pl.to_pandas()
     except Exception:
          # Polarsで読めない場合のフォールバック
-        df = pd.read_csv(file)
+        df_pl = pl.from_pandas(pd.read_csv(file))
 
     # 元のカラム名を保存（エラーメッセージ用）
-    original_columns = list(df.columns)
+    original_columns = list(df_pl.columns)
 
     # カラム名マッピング（表記揺れ吸収）
     rename_map = {
@@ -38,11 +42,11 @@ def load_csv(file) -> pd.DataFrame:
     # ここでは厳密にチェックし、なければエラーとするか、柔軟に対応するか
     # 仕様書通り「銀行名,年月日,摘要,払戻,お預り,差引残高」前提
 
-    df = df.rename(columns=rename_map)
+    df_pl = df_pl.rename({k: v for k, v in rename_map.items() if k in df_pl.columns})
 
     # 必須カラムのチェック
     required_columns = ["date", "description", "amount_out", "amount_in", "balance"]
-    missing_columns = [col for col in required_columns if col not in df.columns]
+    missing_columns = [col for col in required_columns if col not in df_pl.columns]
 
     if missing_columns:
         # エラーメッセージで実際のカラム名を表示
@@ -56,16 +60,27 @@ def load_csv(file) -> pd.DataFrame:
     # CSVに銀行名がある場合は保持（後でaccount_id生成に使用）
     # CSVから読み取った銀行名等の情報を別カラムに保存
     csv_metadata = {}
-    if "銀行名" in df.columns:
-        csv_metadata["bank_name"] = str(df["銀行名"].iloc[0]) if len(df) > 0 else ""
-    if "branch_name" in df.columns:
-        csv_metadata["branch_name"] = str(df["branch_name"].iloc[0]) if len(df) > 0 else ""
-    if "account_number" in df.columns:
+    if "銀行名" in df_pl.columns:
+        csv_metadata["bank_name"] = str(df_pl["銀行名"][0]) if len(df_pl) > 0 else ""
+    if "branch_name" in df_pl.columns:
+        csv_metadata["branch_name"] = str(df_pl["branch_name"][0]) if len(df_pl) > 0 else ""
+    if "account_number" in df_pl.columns:
         # 口座番号は数値型の可能性があるので文字列に変換
-        csv_metadata["account_number"] = str(df["account_number"].iloc[0]) if len(df) > 0 else ""
-    if "種別" in df.columns:
+        csv_metadata["account_number"] = str(df_pl["account_number"][0]) if len(df_pl) > 0 else ""
+    if "種別" in df_pl.columns:
         # 口座種別（普通、当座など）
-        csv_metadata["account_type"] = str(df["種別"].iloc[0]) if len(df) > 0 else ""
+        csv_metadata["account_type"] = str(df_pl["種別"][0]) if len(df_pl) > 0 else ""
+
+    # 金額カラムはPolars式で一括変換（カンマ入り文字列除去など）
+    # 円単位の金額はint32で十分（±21億円）なので半分のメモリ幅に落とす
+    df_pl = df_pl.with_columns([
+        pl.col(col).cast(pl.Utf8).str.replace_all(",", "")
+            .cast(pl.Float64, strict=False).fill_null(0).cast(pl.Int32)
+        for col in ["amount_out", "amount_in", "balance"]
+    ])
+
+    # 必須カラムに絞ってからpandasへ変換（銀行名等はメタデータとして取得済み）
+    df = df_pl.select(required_columns).to_pandas()
 
     # 和暦を西暦に変換する関数
     def convert_japanese_date(date_str):
@@ -115,26 +130,7 @@ def load_csv(file) -> pd.DataFrame:
             f"日付形式を確認してください（例: 2024-01-01, 2024/01/01, H28.6.3）"
         )
 
-    for col in ["amount_out", "amount_in", "balance"]:
-        if col in df.columns:
-            # カンマ入り文字列除去など
-            if df[col].dtype == object:
-                df[col] = df[col].astype(str).str.replace(",", "").astype(float).fillna(0).astype(int)
-            else:
-                df[col] = df[col].fillna(0).astype(int)
-
-    # 不要なカラムを削除（銀行名等はメタデータとして取得済み）
-    # 必須カラム以外をすべて削除
-    required_keep = ["date", "description", "amount_out", "amount_in", "balance"]
-    cols_to_drop = [col for col in df.columns if col not in required_keep]
-    df = df.drop(columns=cols_to_drop)
-
-    # メタデータを返す方法がないので、DataFrameに一時的に保存
-    # 呼び出し側でこの情報を使用できるようにする
-    if csv_metadata:
-        df.attrs["csv_metadata"] = csv_metadata
-
-    return df
+    return df, csv_metadata
 
 def validate_balance(df: pd.DataFrame) -> pd.DataFrame:
     """
@@ -142,42 +138,27 @@ def validate_balance(df: pd.DataFrame) -> pd.DataFrame:
     前行残高 + 入金 - 出金 = 今回残高
     不一致行にフラグを立てる等の処理（今回は検証結果として返すのみ）
     """
-    # CSVの元の行順序を保存（同じ日付の取引の順序を保持するため）
-    df = df.reset_index(drop=True)
-    df["_original_order"] = df.index
-
-    # 日付昇順、元の行順でソート（同じ日付の場合は元の順序を維持）
-    df = df.sort_values(["date", "_original_order"]).reset_index(drop=True)
-    
-    check_results = []
-    prev_balance = None
-    
+    # 日付昇順でソート（安定ソートなので同じ日付の取引はCSVの行順序を維持する）
+    df = df.sort_values("date", ignore_index=True, kind="mergesort")
+
+
     # 計算列追加（検証用）
     df["calc_balance"] = 0
     df["is_balance_error"] = False
 
-    # 最初の行はチェックできない（基準とする）
+    # 不一致があってもCSVの残高を正として次行へ進む（OCRの値を信じる）ため、
+    # 期待残高は常に「前行のCSV残高 + 入金 - 出金」となり、行ループなしで
+    # 一括計算できる。最初の行はチェックできない（基準とする）。
     if len(df) > 0:
-        prev_balance = df.iloc[0]["balance"]
-        df.at[0, "calc_balance"] = prev_balance
-
-        for i in range(1, len(df)):
-            current = df.iloc[i]
-            expected = prev_balance + current["amount_in"] - current["amount_out"]
-            
-            df.at[i, "calc_balance"] = expected
-            
-            if expected != current["balance"]:
-                df.at[i, "is_balance_error"] = True
-                # エラーがあっても、CSVの残高を正として次へ進むか、計算値を正とするか
-                # 通常はCSVが正。通帳の印字ミスは稀だがOCRミスはありうる。
-                # ここではCSVの残高を次のprev_balanceにする（OCRの値を信じる）
-                prev_balance = current["balance"]
-            else:
-                prev_balance = expected
-
-    # 一時的に追加したカラムを削除
-    if "_original_order" in df.columns:
-        df = df.drop(columns=["_original_order"])
+        bal = df["balance"].to_numpy()
+        amount_in = df["amount_in"].to_numpy()
+        amount_out = df["amount_out"].to_numpy()
+
+        calc = np.empty_like(bal)
+        calc[0] = bal[0]
+        calc[1:] = bal[:-1] + amount_in[1:] - amount_out[1:]
+
+        df["calc_balance"] = calc
+        df["is_balance_error"] = calc != bal
 
     return df
@@ -0,0 +1,66 @@
+import hashlib
+import os
+import sqlite3
+from . import config
+
+# プロンプトの版数。プロンプト文面を大きく変えたらここを上げて古いキャッシュを無効化する
+PROMPT_VERSION = "v1"
+
+def _db_path() -> str:
+    return os.path.join(config.DATA_DIR, "llm_cache.db")
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(_db_path())
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS classifications (
+        key TEXT PRIMARY KEY,
+        category TEXT
+    )
+    """)
+    return conn
+
+def make_key(text: str) -> str:
+    # 摘要の生テキストは保存せず、モデル名・プロンプト版数込みのハッシュだけを
+    # キーに使う（モデルやプロンプトを変えれば自然にキャッシュミスになる）
+    raw = f"{config.OLLAMA_MODEL}|{PROMPT_VERSION}|{text}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def get_many(texts: list[str]) -> dict[str, str]:
+    """キャッシュ済みの分類をまとめて引く（摘要 -> カテゴリ）"""
+    if not texts:
+        return {}
+
+    key_to_text = {make_key(t): t for t in texts}
+    try:
+        conn = _connect()
+        try:
+            placeholders = ",".join("?" * len(key_to_text))
+            rows = conn.execute(
+                f"SELECT key, category FROM classifications WHERE key IN ({placeholders})",
+                list(key_to_text)
+            ).fetchall()
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"LLMキャッシュ読み込みエラー: {e}")
+        return {}
+
+    return {key_to_text[key]: category for key, category in rows}
+
+def set_many(results: dict[str, str]):
+    """分類結果をキャッシュに保存する（摘要 -> カテゴリ）"""
+    if not results:
+        return
+
+    try:
+        conn = _connect()
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO classifications (key, category) VALUES (?, ?)",
+                [(make_key(text), category) for text, category in results.items()]
+            )
+            conn.commit()
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"LLMキャッシュ書き込みエラー: {e}")
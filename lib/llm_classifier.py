@@ -1,12 +1,48 @@
+import functools
+import os
 import requests
 import json
+import re
+import time
+import unicodedata
 import pandas as pd
-from . import config
+from concurrent.futures import ThreadPoolExecutor
+from . import config, llm_cache
+
+# Ollamaへのバッチ問い合わせ1回あたりの摘要件数
+# （大きくしすぎるとプロンプトが長くなり応答の劣化・遅延が起きるため30件程度に抑える）
+OLLAMA_BATCH_SIZE = 30
+
+# Ollamaへの同時リクエスト数（Ollama側のOLLAMA_NUM_PARALLELと揃えるのが目安）
+OLLAMA_NUM_PARALLEL = int(os.getenv("OLLAMA_NUM_PARALLEL", "4"))
+
+# TCP接続を使い回すためのセッション（リクエスト毎のハンドシェイクを省く）
+_SESSION = requests.Session()
+
+# LLM回答の照合用タグ表（優先順位順）
+# UTF-8バイト列のfindで部分一致させる（C実装の走査で、文字列inの繰り返しより軽い）
+_CATEGORY_TAGS = [
+    (cat.encode("utf-8"), cat)
+    for cat in ("生活費", "贈与", "関連会社", "銀行", "証券会社", "保険会社", "その他")
+]
 
 def load_classification_patterns():
     """
     設定ファイルから分類パターンを読み込む
+    分類は行ごとに呼ばれるため、設定ファイルの更新時刻をキーにキャッシュし、
+    JSONの読み直しはファイルが変わったときだけ行う。
     """
+    mtime = None
+    if hasattr(config, 'CONFIG_FILE'):
+        try:
+            if config.CONFIG_FILE.exists():
+                mtime = config.CONFIG_FILE.stat().st_mtime
+        except:
+            pass
+    return _load_classification_patterns_cached(mtime)
+
+@functools.lru_cache(maxsize=1)
+def _load_classification_patterns_cached(mtime):
     default_patterns = {
         "生活費": [
             "イオン", "セブン", "ローソン", "ファミマ", "スーパー", "マート",
@@ -88,12 +124,85 @@ def classify_by_rules(text: str, amount_out: int, amount_in: int) -> str:
     # どれにも該当しない場合はその他
     return "その他"
 
+# 取引番号などを符号化した数字列（3桁以上）は分類に寄与しないのでマスクする
+_DIGIT_RUN = re.compile(r"\d{3,}")
+
+def canonicalize_description(text: str) -> str:
+    """
+    摘要を正規化する（AI分類・キャッシュのキー用）
+    全角/半角・空白・取引番号だけが違う摘要は同じ分類になるはずなので、
+    NFKC正規化＋空白圧縮＋数字列マスクでキー空間を縮め、LLM呼び出しと
+    キャッシュミスを減らす。ルールベース分類は原文のまま照合する。
+    """
+    normalized = unicodedata.normalize("NFKC", text)
+    normalized = _DIGIT_RUN.sub("#", normalized)
+    normalized = re.sub(r"\s+", " ", normalized).strip().lower()
+    return normalized
+
+def classify_series(descs: pd.Series, amount_out: pd.Series, amount_in: pd.Series) -> pd.Series:
+    """
+    DataFrame全体をまとめてルールベース分類する
+    classify_by_rulesと同じ優先順位・同じ判定だが、カテゴリごとに
+    キーワードを1本の正規表現にまとめてstr.containsで一括照合するため、
+    1行ずつPythonループを回すより大幅に速い。
+    """
+    patterns = load_classification_patterns()
+
+    def category_pattern(cat: str):
+        keywords = patterns.get(cat, [])
+        if not keywords:
+            return None
+        return "|".join(re.escape(kw) for kw in keywords)
+
+    result = pd.Series(None, index=descs.index, dtype=object)
+    unresolved = pd.Series(True, index=descs.index)
+
+    # 優先順位: 生活費 -> 証券/保険/銀行/関連会社（classify_by_rulesと同順）
+    for cat in ["生活費", "証券会社", "保険会社", "銀行", "関連会社"]:
+        pattern = category_pattern(cat)
+        if pattern is None:
+            continue
+        hit = unresolved & descs.str.contains(pattern, regex=True, na=False)
+        result[hit] = cat
+        unresolved &= ~hit
+
+    # 贈与判定（100万円以上の振込のみ贈与、少額はその他）
+    gift_pattern = category_pattern("贈与")
+    if gift_pattern is not None:
+        gift_hit = unresolved & descs.str.contains(gift_pattern, regex=True, na=False)
+        result[gift_hit & (amount_out >= 1_000_000)] = "贈与"
+        result[gift_hit & (amount_out < 1_000_000)] = "その他"
+        unresolved &= ~gift_hit
+
+    # どれにも該当しない場合はその他
+    result[unresolved] = "その他"
+    return result
+
+# 生成APIの呼び出しが直近で成功していれば、疎通確認そのものを省略する
+# （分類実行の直後に再度ボタンを押すケースで、HEADの往復すら不要になる）
+_OLLAMA_SUCCESS_TTL = 60
+_last_ollama_success = 0.0
+
+def _record_ollama_success():
+    global _last_ollama_success
+    _last_ollama_success = time.monotonic()
+
 def check_ollama_available() -> bool:
     """
     Ollamaが利用可能かチェック
+    直近_OLLAMA_SUCCESS_TTL秒以内に生成API呼び出しが成功していれば疎通済みとみなす。
+    それ以外はStreamlitが操作のたびにページを再実行するため、結果は30秒単位で
+    キャッシュし、毎回のタイムアウト待ち（最悪2秒）を避ける。
     """
+    if time.monotonic() - _last_ollama_success < _OLLAMA_SUCCESS_TTL:
+        return True
+    return _check_ollama_available_cached(int(time.time()) // 30)
+
+@functools.lru_cache(maxsize=4)
+def _check_ollama_available_cached(bucket: int) -> bool:
     try:
-        response = requests.get("http://localhost:11434/api/tags", timeout=2)
+        # 疎通確認だけなのでルートへのHEADで十分（/api/tagsより軽い）
+        response = _SESSION.head("http://localhost:11434/", timeout=0.5)
         return response.status_code == 200
     except:
         return False
@@ -112,6 +221,9 @@ def classify_transactions(df: pd.DataFrame, use_ollama: bool = None) -> pd.DataF
     # カテゴリカラムがなければ追加
     if "category" not in df.columns:
         df["category"] = None
+    elif isinstance(df["category"].dtype, pd.CategoricalDtype):
+        # Categoricalのままだと未知のカテゴリを代入できないため一旦objectに戻す
+        df["category"] = df["category"].astype(object)
 
     # 対象抽出: descriptionがあり、categoryがNaNのもの
     target_mask = (df["description"].notna()) & (df["description"] != "") & (df["category"].isna())
@@ -124,35 +236,56 @@ def classify_transactions(df: pd.DataFrame, use_ollama: bool = None) -> pd.DataF
     if use_ollama is None:
         use_ollama = check_ollama_available()
 
+    # 摘要ごとの代表行（最初の1件）をgroupbyで一括取得し、分類は摘要単位で行う
+    # （同じ摘要を行数ぶん繰り返し分類しない。ループ内でtarget_dfを摘要ごとに
+    # 全走査するとO(摘要数×行数)になる）
+    firsts = target_df.groupby("description", sort=False)[
+        ["amount_out", "amount_in"]
+    ].first().reset_index()
+    rule_categories = classify_series(
+        firsts["description"], firsts["amount_out"], firsts["amount_in"]
+    )
+
     if use_ollama:
         print(f"AI分類を実行中... (対象: {len(target_df)}件)")
         classification_map = {}
-        unique_descriptions = target_df["description"].unique()
-
-        for desc in unique_descriptions:
-            # まずルールベースで試す
-            row = target_df[target_df["description"] == desc].iloc[0]
-            rule_category = classify_by_rules(desc, row["amount_out"], row["amount_in"])
 
-            # ルールベースで「その他」になった場合のみAI分類
+        # まずルールベースで試し、「その他」になったものだけAI分類に回す
+        ai_targets = []
+        for desc, rule_category in zip(firsts["description"], rule_categories):
             if rule_category == "その他":
-                category = call_ollama(desc)
+                ai_targets.append(desc)
             else:
-                category = rule_category
+                classification_map[desc] = rule_category
+
+        # 表記揺れだけが違う摘要を正規化形にまとめ、LLMには正規化形だけを渡す
+        canon_map = {desc: canonicalize_description(desc) for desc in ai_targets}
+        canon_targets = list(dict.fromkeys(canon_map.values()))
+
+        # 過去の実行で分類済みの摘要はキャッシュから引く（案件を跨いで共有）
+        canon_results = llm_cache.get_many(canon_targets)
+        pending = [canon for canon in canon_targets if canon not in canon_results]
+
+        # AI分類はバッチでまとめて問い合わせる（1リクエスト=最大OLLAMA_BATCH_SIZE件）
+        # さらにバッチ同士はスレッドプールで並行実行し、HTTP待ちを重ねる
+        chunks = [
+            pending[i:i + OLLAMA_BATCH_SIZE]
+            for i in range(0, len(pending), OLLAMA_BATCH_SIZE)
+        ]
+        if chunks:
+            new_results = {}
+            with ThreadPoolExecutor(max_workers=OLLAMA_NUM_PARALLEL) as executor:
+                for chunk, result in zip(chunks, executor.map(call_ollama_batch, chunks)):
+                    new_results.update(zip(chunk, result))
+            canon_results.update(new_results)
+            llm_cache.set_many(new_results)
 
-            classification_map[desc] = category
+        # 正規化形の結果を元の摘要に書き戻す
+        for desc, canon in canon_map.items():
+            classification_map[desc] = canon_results.get(canon, "その他")
     else:
         print(f"ルールベース分類を実行中... (対象: {len(target_df)}件)")
-        classification_map = {}
-
-        for idx in target_df.index:
-            row = target_df.loc[idx]
-            category = classify_by_rules(
-                row["description"],
-                row["amount_out"],
-                row["amount_in"]
-            )
-            classification_map[row["description"]] = category
+        classification_map = dict(zip(firsts["description"], rule_categories))
 
     # 結果をマッピング
     df.loc[target_mask, "category"] = df.loc[target_mask, "description"].map(classification_map)
@@ -186,15 +319,16 @@ def call_ollama(text: str) -> str:
     }
 
     try:
-        response = requests.post(config.OLLAMA_BASE_URL, json=payload, timeout=30)
+        response = _SESSION.post(config.OLLAMA_BASE_URL, json=payload, timeout=30)
         if response.status_code == 200:
+            _record_ollama_success()
             result = response.json().get("response", "").strip()
-            # 想定外の回答が含まれていないか簡易チェック
-            valid_categories = ["生活費", "贈与", "関連会社", "銀行", "証券会社", "保険会社", "その他"]
-            
+
             # 部分一致で判定（LLMが余計な文字をつける場合があるため）
-            for cat in valid_categories:
-                if cat in result:
+            # 想定外の回答はタグ表に当たらず「その他」に倒れる
+            result_bytes = result.encode("utf-8")
+            for tag_bytes, cat in _CATEGORY_TAGS:
+                if result_bytes.find(tag_bytes) >= 0:
                     return cat
             return "その他"
         else:
@@ -203,3 +337,63 @@ def call_ollama(text: str) -> str:
     except Exception as e:
         print(f"Ollama Connection Error: {e}")
         return "その他"
+
+def call_ollama_batch(texts: list[str]) -> list[str]:
+    """
+    複数の摘要をまとめて1リクエストで分類する（Ollama使用）
+    1件ずつ問い合わせるとHTTP往復とプロンプト処理のコストがN回かかるため、
+    番号付きリストで一括問い合わせし、回答を行ごとにパースして返す。
+    """
+    if not texts:
+        return []
+
+    numbered = "\n".join(f"{i + 1}. {text}" for i, text in enumerate(texts))
+    prompt = f"""
+    あなたは相続税調査の専門家です。以下の{len(texts)}件の銀行取引の摘要について、それぞれ最も適切なカテゴリを1つだけ選んで回答してください。
+    回答は「番号: カテゴリ名」の形式で1行に1件ずつ返し、それ以外の文章は一切含めないでください。
+    例:
+    1: 生活費
+    2: その他
+
+    カテゴリ候補:
+    - 生活費 (スーパー、コンビニ、水道光熱費、通信費、NHKなど)
+    - 贈与 (家族名義への振込、使途不明な個人への送金など)
+    - 関連会社 (同族会社、取引先などの法人関連)
+    - 銀行 (定期預金、積立、銀行手数料以外の手続き)
+    - 証券会社 (証券口座への入出金、配当金、投資信託)
+    - 保険会社 (保険料、共済掛金、給付金)
+    - その他 (手数料、利息、不明なもの)
+
+    摘要一覧:
+{numbered}
+    """
+
+    payload = {
+        "model": config.OLLAMA_MODEL,
+        "prompt": prompt,
+        "stream": False
+    }
+
+    # パースできなかった番号は「その他」に倒す
+    categories = ["その他"] * len(texts)
+    line_pattern = re.compile(
+        r"^\s*(\d+)\s*[.:：]\s*(生活費|贈与|関連会社|銀行|証券会社|保険会社|その他)"
+    )
+
+    try:
+        response = _SESSION.post(config.OLLAMA_BASE_URL, json=payload, timeout=60)
+        if response.status_code == 200:
+            _record_ollama_success()
+            result = response.json().get("response", "")
+            for line in result.splitlines():
+                match = line_pattern.match(line)
+                if match:
+                    idx = int(match.group(1)) - 1
+                    if 0 <= idx < len(texts):
+                        categories[idx] = match.group(2)
+        else:
+            print(f"Ollama API Error: {response.status_code}")
+    except Exception as e:
+        print(f"Ollama Connection Error: {e}")
+
+    return categories
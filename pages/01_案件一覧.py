@@ -6,6 +6,11 @@ from lib import config, db_manager
 st.set_page_config(page_title="案件一覧", page_icon="📂")
 st.title("📂 案件一覧")
 
+@st.cache_data(ttl=60, show_spinner=False)
+def _load_transactions_cached(case_name):
+    """再描画のたびにSQLiteを読み直さないよう、読み込み結果を短時間キャッシュする"""
+    return db_manager.load_transactions(case_name)
+
 # 新規作成
 with st.expander("新規案件作成", expanded=True):
     new_case_name = st.text_input("案件名（例：山田太郎_相続）")
@@ -32,50 +37,59 @@ else:
                 st.write(f"📁 **{case}**")
 
                 # 口座情報を取得して表示
-                df = db_manager.load_transactions(case)
+                df = _load_transactions_cached(case)
                 if not df.empty and 'account_id' in df.columns and 'holder' in df.columns:
                     # 口座情報を抽出
                     accounts = df.groupby(['account_id', 'holder']).size().reset_index()[['account_id', 'holder']]
 
                     if not accounts.empty:
                         st.caption("📊 登録口座:")
-                        for idx, row in accounts.iterrows():
+
+                        # 口座ごとにst.markdownを呼ばず、表示行をまとめて1回で描画する
+                        # （itertuplesは行ごとのSeries生成がなくiterrowsより軽い）
+                        lines = []
+                        for account_id, holder in accounts.itertuples(index=False):
                             # account_idから銀行名と口座番号を抽出
-                            parts = row['account_id'].rsplit('_', 1)
+                            parts = account_id.rsplit('_', 1)
                             if len(parts) == 2:
-                                bank_name = parts[0]
-                                account_num = parts[1]
-                                account_display = f"**{bank_name}** / 口座番号: {account_num} / 名義: {row['holder']}"
+                                lines.append(f"　・**{parts[0]}** / 口座番号: {parts[1]} / 名義: {holder}")
                             else:
-                                account_display = f"{row['account_id']} / 名義: {row['holder']}"
-
-                            # 口座ごとに削除ボタン
-                            acc_col1, acc_col2 = st.columns([5, 1])
-                            with acc_col1:
-                                st.markdown(f"　・{account_display}")
-                            with acc_col2:
-                                if st.button("🗑️", key=f"delete_acc_{case}_{row['account_id']}", help="この口座のデータを削除"):
-                                    st.session_state[f"confirm_delete_acc_{case}_{row['account_id']}"] = True
-                                    st.rerun()
-
-                            # 口座削除の確認ダイアログ
-                            if st.session_state.get(f"confirm_delete_acc_{case}_{row['account_id']}", False):
-                                st.warning(f"⚠️ 口座「{row['account_id']}」のデータを削除しますか？")
-                                st.caption("この操作は取り消せません。")
-
-                                acc_yes, acc_no = st.columns(2)
-                                with acc_yes:
-                                    if st.button("削除", key=f"confirm_acc_yes_{case}_{row['account_id']}", type="primary"):
-                                        if db_manager.delete_account_transactions(case, row['account_id']):
-                                            del st.session_state[f"confirm_delete_acc_{case}_{row['account_id']}"]
-                                            st.success(f"口座「{row['account_id']}」を削除しました。")
-                                            st.rerun()
-                                        else:
-                                            st.error("削除に失敗しました。")
-                                with acc_no:
-                                    if st.button("キャンセル", key=f"confirm_acc_no_{case}_{row['account_id']}"):
-                                        del st.session_state[f"confirm_delete_acc_{case}_{row['account_id']}"]
+                                lines.append(f"　・{account_id} / 名義: {holder}")
+                        st.markdown("\n\n".join(lines))
+
+                        # 口座データの削除は口座を選んでまとめて1つのUIで行う
+                        acc_col1, acc_col2 = st.columns([5, 1])
+                        with acc_col1:
+                            target_account = st.selectbox(
+                                "削除する口座",
+                                accounts["account_id"].tolist(),
+                                key=f"delete_acc_select_{case}",
+                                label_visibility="collapsed"
+                            )
+                        with acc_col2:
+                            if st.button("🗑️", key=f"delete_acc_{case}", help="選択した口座のデータを削除"):
+                                st.session_state[f"confirm_delete_acc_{case}"] = True
+                                st.rerun()
+
+                        # 口座削除の確認ダイアログ
+                        if st.session_state.get(f"confirm_delete_acc_{case}", False):
+                            st.warning(f"⚠️ 口座「{target_account}」のデータを削除しますか？")
+                            st.caption("この操作は取り消せません。")
+
+                            acc_yes, acc_no = st.columns(2)
+                            with acc_yes:
+                                if st.button("削除", key=f"confirm_acc_yes_{case}", type="primary"):
+                                    if db_manager.delete_account_transactions(case, target_account):
+                                        _load_transactions_cached.clear()
+                                        del st.session_state[f"confirm_delete_acc_{case}"]
+                                        st.success(f"口座「{target_account}」を削除しました。")
                                         st.rerun()
+                                    else:
+                                        st.error("削除に失敗しました。")
+                            with acc_no:
+                                if st.button("キャンセル", key=f"confirm_acc_no_{case}"):
+                                    del st.session_state[f"confirm_delete_acc_{case}"]
+                                    st.rerun()
                 else:
                     st.caption("データ未登録")
 
@@ -99,6 +113,7 @@ else:
                     if st.button("はい、削除します", key=f"confirm_yes_{case}", type="primary"):
                         # db_managerの削除関数を使用
                         if db_manager.delete_case(case):
+                            _load_transactions_cached.clear()
                             # 現在選択中の案件が削除対象の場合、セッション状態をクリア
                             if st.session_state.get("current_case") == case:
                                 del st.session_state["current_case"]
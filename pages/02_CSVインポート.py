@@ -1,6 +1,6 @@
 import streamlit as st
 import pandas as pd
-from lib import db_manager, importer, analyzer
+from lib import config, db_manager, importer, analyzer
 
 st.set_page_config(page_title="CSVインポート", page_icon="📥")
 st.title("📥 CSVインポート")
@@ -19,8 +19,7 @@ uploaded_file = st.file_uploader("通帳CSVを選択", type=["csv"], key="csv_up
 if uploaded_file is not None:
     try:
         # CSVを読み込み
-        df = importer.load_csv(uploaded_file)
-        csv_metadata = df.attrs.get("csv_metadata", {})
+        df, csv_metadata = importer.load_csv(uploaded_file)
 
         st.success(f"✅ CSVを読み込みました（{len(df)}件）")
 
@@ -91,8 +90,9 @@ if uploaded_file is not None:
             else:
                 # 口座情報の付与
                 account_id = f"{bank_name}_{account_num}"
-                df["account_id"] = account_id
-                df["holder"] = holder_name
+                # 口座ID・名義人は値の種類が少ないのでCategoricalで持つ（メモリ削減）
+                df["account_id"] = pd.Series(account_id, index=df.index, dtype="category")
+                df["holder"] = pd.Series(holder_name, index=df.index, dtype="category")
 
                 # 検証（残高チェック）
                 df = importer.validate_balance(df)
@@ -205,24 +205,56 @@ if "preview_df" in st.session_state and "account_info" in st.session_state:
         df = st.session_state["preview_df"]
 
         try:
-            # 既存データのロード
-            existing_df = db_manager.load_transactions(current_case)
-            if not existing_df.empty:
-                # 結合
-                combined_df = pd.concat([existing_df, df], ignore_index=True)
-            else:
-                combined_df = df
-
             # 検証用カラムを削除（DBに保存する前に）
             cols_to_drop = ["calc_balance", "is_balance_error"]
-            combined_df = combined_df.drop(columns=[col for col in cols_to_drop if col in combined_df.columns])
+            df = df.drop(columns=[col for col in cols_to_drop if col in df.columns])
+
+            # 多額フラグは行単位で決まるので新規データだけ分析すればよい
+            df = analyzer.analyze_large_amounts(df)
 
-            # 分析実行（全体に対して再分析）
-            combined_df = analyzer.analyze_large_amounts(combined_df)
-            combined_df = analyzer.analyze_transfers(combined_df)
+            # 既存データのロード
+            existing_df = db_manager.load_transactions(current_case)
+
+            if existing_df.empty:
+                new_rows = analyzer.analyze_transfers(df)
+                updated_existing = None
+            else:
+                # 資金移動ペアリングは口座跨ぎの照合が必要だが、新規データの
+                # 相手になり得るのは期間±検出窓にかかる既存行だけ。
+                # 全履歴ではなくその部分だけを混ぜて再分析する
+                window = pd.Timedelta(days=config.TRANSFER_DAYS_WINDOW)
+                context_mask = existing_df["date"].between(
+                    df["date"].min() - window, df["date"].max() + window
+                )
+                analyzed = analyzer.analyze_transfers(
+                    pd.concat([existing_df[context_mask], df], ignore_index=True)
+                )
 
-            # 保存
-            db_manager.save_transactions(current_case, combined_df)
+                # 窓の外とペア済みの既存行のフラグを消さないよう、既存行は
+                # 旧フラグとOR合成で書き戻す（idで対応づけ）
+                if "id" in analyzed.columns and "is_transfer" in existing_df.columns:
+                    old_flags = existing_df.loc[context_mask, ["id", "is_transfer", "transfer_to"]]
+                    analyzed = analyzed.merge(old_flags, on="id", how="left", suffixes=("", "_old"))
+                    keep_old = (
+                        analyzed["is_transfer_old"].fillna(False).astype(bool)
+                        & ~analyzed["is_transfer"].astype(bool)
+                    )
+                    analyzed.loc[keep_old, "is_transfer"] = True
+                    analyzed.loc[keep_old, "transfer_to"] = analyzed.loc[keep_old, "transfer_to_old"]
+                    analyzed = analyzed.drop(columns=["is_transfer_old", "transfer_to_old"])
+
+                # 新規行（idなし）と再分析した既存行（idあり）に分ける
+                new_mask = analyzed["id"].isna()
+                new_rows = analyzed[new_mask].drop(columns=["id"])
+                updated_existing = analyzed[~new_mask]
+
+            # 保存: 全件洗い替えではなく、新規行の追記＋既存行のフラグ差分更新
+            db_manager.save_transactions(current_case, new_rows, mode="append")
+            if updated_existing is not None and not updated_existing.empty:
+                db_manager.update_transfer_flags(current_case, updated_existing)
+
+            # 各ページの読み込みキャッシュを破棄（次の表示でDBから読み直させる）
+            st.cache_data.clear()
 
             st.success("✅ 保存と分析が完了しました。「分析・表示」メニューで結果を確認してください。")
 
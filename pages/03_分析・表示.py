@@ -1,5 +1,8 @@
+import os
 import streamlit as st
+import numpy as np
 import pandas as pd
+import polars as pl
 import plotly.express as px
 import plotly.graph_objects as go
 from lib import db_manager
@@ -7,6 +10,76 @@ from lib import db_manager
 st.set_page_config(page_title="分析・表示", page_icon="📊", layout="wide")
 st.title("📊 分析結果")
 
+@st.cache_data(show_spinner=False)
+def _load_transactions_cached(case_name, db_mtime):
+    """
+    読み込み＋正規化（日付変換・カラム補完・Categorical化）をまとめてキャッシュする
+    DBファイルのmtimeをキーに含めるので、保存・削除があれば自動で読み直される
+    """
+    # 表示・分類で使うカラムだけをSELECTする（idは分類修正の更新キーに必要）
+    df = db_manager.load_transactions(case_name, columns=[
+        "id", "date", "account_id", "holder", "description",
+        "amount_out", "amount_in", "balance",
+        "is_large", "is_transfer", "transfer_to", "category",
+    ])
+    if df.empty:
+        return df
+
+    # 日付型変換（DBから読み込むと文字列になるため）
+    # cache=True: 同じ日付が多いのでユニーク日付だけパースされる
+    df["date"] = pd.to_datetime(df["date"], cache=True).dt.date
+
+    # categoryカラムがない場合はNoneで追加（スキーママイグレーション前のデータ対策）
+    if "category" not in df.columns:
+        df["category"] = None
+
+    # 金額は収まる最小の整数幅（円単位ならint32）へ、フラグは1バイトのboolへ落とす
+    # （フィルタ走査やマスク計算はメモリ帯域で律速するため、幅が半分なら走査も軽い）
+    for col in ["amount_out", "amount_in", "balance"]:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], downcast="integer")
+    for col in ["is_large", "is_transfer"]:
+        if col in df.columns:
+            df[col] = df[col].fillna(0).astype(bool)
+
+    # 値の種類が少ないカラムはCategoricalに変換
+    # （groupby・isinが整数コード上で動き、メモリも削減される）
+    for col in ["account_id", "holder", "category"]:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+
+    return df
+
+def _case_db_mtime(case_name):
+    db_path = db_manager.get_case_db_path(case_name)
+    return os.path.getmtime(db_path) if os.path.exists(db_path) else 0.0
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _account_summary_cached(_df, case_name, row_count, last_date):
+    """口座サマリーの集計をキャッシュする（case_name・件数・最終取引日をキーにする）"""
+    # 表示で使うのは件数だけなのでsize()のみ計算する
+    # （date列のmaxは全行走査が必要だが、どこにも表示していなかった）
+    return (
+        _df.groupby(['account_id', 'holder'], observed=True)
+        .size().reset_index(name="取引件数")
+    )
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _transfer_timeline_fig(_out_transfers, case_name, row_count, last_date):
+    """資金移動タイムライン図の生成をキャッシュする（案件・件数・最終取引日をキー）"""
+    fig = px.scatter(
+        _out_transfers,
+        x="date",
+        y="amount_out",
+        color="flow_label",
+        size="amount_out",
+        hover_data=["description", "balance"],
+        labels={"date": "日付", "amount_out": "移動金額", "flow_label": "移動ルート"},
+        title="資金移動の時系列分布"
+    )
+    fig.update_layout(height=500)
+    return fig
+
 if "current_case" not in st.session_state:
     st.warning("まずは「案件一覧」から案件を選択してください。")
     st.stop()
@@ -15,28 +88,26 @@ current_case = st.session_state["current_case"]
 st.info(f"対象案件: **{current_case}**")
 
 # データロード
-df = db_manager.load_transactions(current_case)
+df = _load_transactions_cached(current_case, _case_db_mtime(current_case))
 
 if df.empty:
     st.warning("データがありません。「CSVインポート」からデータを取り込んでください。")
     st.stop()
 
-# 日付型変換（DBから読み込むと文字列になるため）
-df["date"] = pd.to_datetime(df["date"]).dt.date
-
 # 必要なカラムがない場合のチェック
 required_cols = ["is_large", "is_transfer", "transfer_to"]
 missing_cols = [col for col in required_cols if col not in df.columns]
 
-# categoryカラムがない場合はNoneで追加（スキーママイグレーション前のデータ対策）
-if "category" not in df.columns:
-    df["category"] = None
-    
 if missing_cols:
     st.error(f"データベースに必要なカラムがありません: {', '.join(missing_cols)}")
     st.info("「CSVインポート」から再度データをインポートしてください。")
     st.stop()
 
+# 各タブで使い回すboolマスクは再実行1回につき1度だけ計算する
+is_transfer_mask = (df["is_transfer"] == True).to_numpy()
+is_large_mask = (df["is_large"] == True).to_numpy()
+categorized_mask = df["category"].notna().to_numpy()
+
 # AI分析モジュール
 from lib import llm_classifier
 
@@ -58,6 +129,7 @@ with st.sidebar:
                         df = llm_classifier.classify_transactions(df, use_ollama=True)
                         # DB保存
                         db_manager.save_transactions(current_case, df)
+                        _load_transactions_cached.clear()
                         st.success("✅ AI分類完了！")
                         st.rerun()
                     except Exception as e:
@@ -73,6 +145,7 @@ with st.sidebar:
                     df = llm_classifier.classify_transactions(df, use_ollama=False)
                     # DB保存
                     db_manager.save_transactions(current_case, df)
+                    _load_transactions_cached.clear()
                     st.success("✅ ルールベース分類完了！")
                     st.rerun()
                 except Exception as e:
@@ -84,68 +157,71 @@ with st.sidebar:
 # 口座サマリーを表示
 st.markdown("### 📋 登録口座一覧")
 with st.container(border=True):
-    accounts = df.groupby(['account_id', 'holder']).agg(
-        取引件数=('date', 'count'),
-        最終取引日=('date', 'max')
-    ).reset_index()
-
-    for idx, row in accounts.iterrows():
-        # account_idから銀行名と口座番号を抽出
-        parts = row['account_id'].rsplit('_', 1)
-        if len(parts) == 2:
-            bank_name = parts[0]
-            account_num = parts[1]
+    accounts = _account_summary_cached(df, current_case, len(df), df["date"].max())
 
+    # account_idから銀行名と口座番号を一括で抽出（行ごとのrsplitを避ける）
+    id_parts = accounts["account_id"].astype(str).str.rsplit("_", n=1, expand=True)
+    accounts["bank_name"] = id_parts[0]
+    accounts["account_num"] = id_parts[1] if 1 in id_parts.columns else None
+
+    # itertuplesは行ごとのSeries生成がなくiterrowsより軽い
+    for row in accounts.itertuples(index=False):
+        if pd.notna(row.account_num):
             col1, col2, col3, col4, col5 = st.columns([3, 2, 2, 2, 1])
             with col1:
-                st.markdown(f"**🏦 {bank_name}**")
+                st.markdown(f"**🏦 {row.bank_name}**")
             with col2:
-                st.markdown(f"口座番号: `{account_num}`")
+                st.markdown(f"口座番号: `{row.account_num}`")
             with col3:
-                st.markdown(f"名義: {row['holder']}")
+                st.markdown(f"名義: {row.holder}")
             with col4:
-                st.markdown(f"取引件数: {row['取引件数']}件")
+                st.markdown(f"取引件数: {row.取引件数}件")
             with col5:
-                if st.button("🗑️", key=f"del_acc_{row['account_id']}", help="この口座のデータを削除"):
-                    st.session_state[f"confirm_delete_account_{row['account_id']}"] = True
+                if st.button("🗑️", key=f"del_acc_{row.account_id}", help="この口座のデータを削除"):
+                    st.session_state[f"confirm_delete_account_{row.account_id}"] = True
                     st.rerun()
         else:
             col1, col2 = st.columns([9, 1])
             with col1:
-                st.markdown(f"・{row['account_id']} / 名義: {row['holder']} / 取引件数: {row['取引件数']}件")
+                st.markdown(f"・{row.account_id} / 名義: {row.holder} / 取引件数: {row.取引件数}件")
             with col2:
-                if st.button("🗑️", key=f"del_acc_{row['account_id']}", help="この口座のデータを削除"):
-                    st.session_state[f"confirm_delete_account_{row['account_id']}"] = True
+                if st.button("🗑️", key=f"del_acc_{row.account_id}", help="この口座のデータを削除"):
+                    st.session_state[f"confirm_delete_account_{row.account_id}"] = True
                     st.rerun()
 
         # 削除確認ダイアログ
-        if st.session_state.get(f"confirm_delete_account_{row['account_id']}", False):
-            st.warning(f"⚠️ 口座「{row['account_id']}」のデータを削除しますか？")
+        if st.session_state.get(f"confirm_delete_account_{row.account_id}", False):
+            st.warning(f"⚠️ 口座「{row.account_id}」のデータを削除しますか？")
             st.caption("この操作は取り消せません。")
 
             col_yes, col_no = st.columns(2)
             with col_yes:
-                if st.button("削除", key=f"confirm_yes_{row['account_id']}", type="primary"):
-                    if db_manager.delete_account_transactions(current_case, row['account_id']):
-                        del st.session_state[f"confirm_delete_account_{row['account_id']}"]
-                        st.success(f"口座「{row['account_id']}」を削除しました。")
+                if st.button("削除", key=f"confirm_yes_{row.account_id}", type="primary"):
+                    if db_manager.delete_account_transactions(current_case, row.account_id):
+                        _load_transactions_cached.clear()
+                        del st.session_state[f"confirm_delete_account_{row.account_id}"]
+                        st.success(f"口座「{row.account_id}」を削除しました。")
                         st.rerun()
                     else:
                         st.error("削除に失敗しました。")
             with col_no:
-                if st.button("キャンセル", key=f"confirm_no_{row['account_id']}"):
-                    del st.session_state[f"confirm_delete_account_{row['account_id']}"]
+                if st.button("キャンセル", key=f"confirm_no_{row.account_id}"):
+                    del st.session_state[f"confirm_delete_account_{row.account_id}"]
                     st.rerun()
 
 st.markdown("---")
 
 # タブ切り替え
+# 各タブの中身は@st.fragmentに分離する。フラグメント内のウィジェット操作は
+# そのフラグメントだけを再実行するため、タブ3でフィルタを触ってもタブ1の
+# Plotly図生成や入出金の結合処理は走り直さない
 tab1, tab2, tab3 = st.tabs(["資金移動フロー", "多額取引", "全取引一覧"])
 
-with tab1:
+@st.fragment
+def _render_transfer_tab(df, is_transfer_mask):
     st.subheader("資金移動の分析")
     # 資金移動フラグがあるもののみ抽出
-    transfers = df[df["is_transfer"] == True]
+    transfers = df[is_transfer_mask]
 
     if transfers.empty:
         st.info("検知された資金移動はありません。")
@@ -157,64 +233,61 @@ with tab1:
              st.info("表示可能な資金移動フローがありません。")
         else:
             # データ加工
-            out_transfers["target_account"] = out_transfers["transfer_to"].apply(lambda x: x.split(" ")[0] if x else "Unknown")
-            out_transfers["flow_label"] = out_transfers["account_id"] + " ➡ " + out_transfers["target_account"]
+            # transfer_to（"口座ID (日付)"）のパースはexpandつき分割1回で済ませ、
+            # 移動先表示と入金側結合キーの両方に使い回す
+            split = out_transfers["transfer_to"].str.split(" ", n=1, expand=True)
+            out_transfers["target_account"] = split[0].fillna("Unknown")
+            out_transfers["flow_label"] = out_transfers["account_id"].astype(str) + " ➡ " + out_transfers["target_account"]
 
             # 1. 個別取引リスト表示
             st.markdown("#### 📋 口座間移動 取引一覧")
             st.caption(f"検出された資金移動: {len(out_transfers)}件")
 
             # ペアの入金取引情報を取得
-            display_list = []
-            for idx, out_row in out_transfers.iterrows():
-                # 入金側の取引を検索
-                transfer_info = out_row["transfer_to"]
-                if transfer_info and " " in transfer_info:
-                    parts = transfer_info.split(" ")
-                    in_account = parts[0]
-                    in_date_str = " ".join(parts[1:])
-
-                    # 入金側の取引を探す（日付の型を統一）
-                    in_tx = df[
-                        (df["account_id"] == in_account) &
-                        (df["date"] == out_row["date"]) &
-                        (df["amount_in"] > 0)
-                    ]
-
-                    if not in_tx.empty:
-                        in_row = in_tx.iloc[0]
-                        display_list.append({
-                            "日付": out_row["date"],
-                            "出金元口座": out_row["account_id"],
-                            "出金額": f"{int(out_row['amount_out']):,}",
-                            "出金摘要": out_row["description"],
-                            "入金先口座": in_account,
-                            "入金額": f"{int(in_row['amount_in']):,}",
-                            "入金摘要": in_row["description"],
-                            "名義人": out_row["holder"]
-                        })
-                    else:
-                        # 入金側が見つからない場合
-                        display_list.append({
-                            "日付": out_row["date"],
-                            "出金元口座": out_row["account_id"],
-                            "出金額": f"{int(out_row['amount_out']):,}",
-                            "出金摘要": out_row["description"],
-                            "入金先口座": in_account,
-                            "入金額": "未検出",
-                            "入金摘要": "未検出",
-                            "名義人": out_row["holder"]
-                        })
-
-            if display_list:
-                display_transfers = pd.DataFrame(display_list)
+            # 出金行ごとにdf全体を走査せず、(入金口座, 日付) のハッシュ結合1回で引く
+            out_transfers["in_account"] = split[0]
+
+            # transfer_toが空・形式外の行は表示対象外
+            valid_transfers = out_transfers[split[1].notna()]
+
+            # 入金側の候補（元実装と同じく同一口座・同一日の最初の1件を採用）
+            in_side = (
+                df.loc[df["amount_in"] > 0, ["account_id", "date", "amount_in", "description"]]
+                .rename(columns={
+                    "account_id": "in_account",
+                    "amount_in": "in_amount",
+                    "description": "in_description"
+                })
+            )
+            in_side["in_account"] = in_side["in_account"].astype(str)
+            in_side = in_side.drop_duplicates(subset=["in_account", "date"])
+
+            merged = valid_transfers.merge(in_side, on=["in_account", "date"], how="left")
+
+            if not merged.empty:
+                # 金額は数値のまま渡し、カンマ区切りはcolumn_configでフロント側に任せる
+                # （Python側で全行を文字列化すると列が文字列型になりソートも壊れる）
+                display_transfers = pd.DataFrame({
+                    "日付": merged["date"],
+                    "出金元口座": merged["account_id"],
+                    "出金額": merged["amount_out"],
+                    "出金摘要": merged["description"],
+                    "入金先口座": merged["in_account"],
+                    "入金額": merged["in_amount"],
+                    "入金摘要": merged["in_description"].fillna("未検出"),
+                    "名義人": merged["holder"]
+                })
                 # 日付降順でソート
                 display_transfers = display_transfers.sort_values("日付", ascending=False)
 
                 st.dataframe(
                     display_transfers,
                     use_container_width=True,
-                    hide_index=True
+                    hide_index=True,
+                    column_config={
+                        "出金額": st.column_config.NumberColumn(format="localized"),
+                        "入金額": st.column_config.NumberColumn(format="localized"),
+                    }
                 )
             else:
                 st.info("表示可能な資金移動がありません。")
@@ -223,22 +296,17 @@ with tab1:
             st.markdown("#### 📅 資金移動タイムライン")
             st.caption("いつ、どの口座間で、どれくらいの金額が動いたかを時系列で表示します。")
 
-            fig = px.scatter(
-                out_transfers,
-                x="date",
-                y="amount_out",
-                color="flow_label",
-                size="amount_out",
-                hover_data=["description", "balance"],
-                labels={"date": "日付", "amount_out": "移動金額", "flow_label": "移動ルート"},
-                title="資金移動の時系列分布"
+            # 図の組み立て（トレース生成・JSON化の手前まで）は再描画のたびに
+            # やり直す必要がないのでキャッシュから引く
+            fig = _transfer_timeline_fig(
+                out_transfers, current_case, len(out_transfers), out_transfers["date"].max()
             )
-            fig.update_layout(height=500)
             st.plotly_chart(fig, use_container_width=True)
 
-with tab2:
+@st.fragment
+def _render_large_tab(df, is_large_mask):
     st.subheader("多額出金・入金リスト")
-    large_tx = df[df["is_large"] == True].sort_values("date", ascending=False)
+    large_tx = df[is_large_mask].sort_values("date", ascending=False)
 
     if large_tx.empty:
         st.info("設定閾値を超える取引はありません。")
@@ -249,10 +317,16 @@ with tab2:
 
         st.dataframe(
             display_large,
-            width="stretch"
+            width="stretch",
+            column_config={
+                "払戻": st.column_config.NumberColumn(format="localized"),
+                "お預り": st.column_config.NumberColumn(format="localized"),
+                "残高": st.column_config.NumberColumn(format="localized"),
+            }
         )
 
-with tab3:
+@st.fragment
+def _render_all_tab(df, categorized_mask):
     st.subheader("取引一覧")
 
     # フィルタ
@@ -261,7 +335,7 @@ with tab3:
         filter_account = st.multiselect("口座絞り込み", df["account_id"].unique())
     with col2:
         # カテゴリーフィルタ（分類済みのもののみ）
-        available_categories = df[df["category"].notna()]["category"].unique().tolist()
+        available_categories = df.loc[categorized_mask, "category"].unique().tolist()
         # "未分類"がDBに含まれている場合があるので重複排除
         unique_options = sorted(list(set(["未分類"] + available_categories)), key=lambda x: (x != "未分類", x))
         
@@ -270,32 +344,31 @@ with tab3:
     with col3:
         keyword = st.text_input("摘要検索")
 
-    filtered_df = df.copy()
+    # 条件ごとに中間フレームを作らず、boolマスクを合成して最後に1回だけ抽出する
+    mask = np.ones(len(df), dtype=bool)
     if filter_account:
-        filtered_df = filtered_df[filtered_df["account_id"].isin(filter_account)]
+        mask &= df["account_id"].isin(filter_account).to_numpy()
     if filter_category:
         # 「未分類」が選択されている場合
         if "未分類" in filter_category:
-            # 未分類のみ、または未分類+他のカテゴリー
+            # 未分類 (NaN or "未分類")
+            uncategorized = (df["category"].isna() | (df["category"] == "未分類")).to_numpy()
             other_categories = [c for c in filter_category if c != "未分類"]
             if other_categories:
-                # 未分類 (NaN or "未分類") OR 指定カテゴリー
-                filtered_df = filtered_df[
-                    filtered_df["category"].isna() |
-                    (filtered_df["category"] == "未分類") |
-                    filtered_df["category"].isin(other_categories)
-                ]
+                # 未分類 OR 指定カテゴリー
+                mask &= uncategorized | df["category"].isin(other_categories).to_numpy()
             else:
-                # 未分類のみ (NaN or "未分類")
-                filtered_df = filtered_df[
-                    filtered_df["category"].isna() | 
-                    (filtered_df["category"] == "未分類")
-                ]
+                # 未分類のみ
+                mask &= uncategorized
         else:
             # 指定カテゴリーのみ
-            filtered_df = filtered_df[filtered_df["category"].isin(filter_category)]
+            mask &= df["category"].isin(filter_category).to_numpy()
     if keyword:
-        filtered_df = filtered_df[filtered_df["description"].str.contains(keyword, na=False)]
+        # 摘要検索はPolarsのリテラル文字列検索で行う
+        # （正規表現解釈なし・SIMD最適化された部分一致。キー入力のたびに走るため）
+        mask &= pl.Series(df["description"].fillna("")).str.contains(keyword, literal=True).to_numpy()
+
+    filtered_df = df[mask]
 
     # 分類修正UI（取引一覧の上部に配置）
     st.markdown("### ✏️ 分類修正")
@@ -303,7 +376,7 @@ with tab3:
     # 取引一覧を表形式で表示し、各行に修正ボタンを配置
     if not filtered_df.empty:
         # すべての表示対象取引を編集可能にする（未分類含む）
-        editable_df = filtered_df.copy()
+        editable_df = filtered_df
 
         if not editable_df.empty:
             st.markdown(f"**修正可能な取引: {len(editable_df)}件**")
@@ -427,6 +500,9 @@ with tab3:
                                 # 成功メッセージをsession_stateに保存
                                 st.session_state["category_update_success"] = f"✅ {success_count}件の取引を「{new_category}」に修正しました！"
 
+                                # キャッシュを破棄してDBから読み直させる
+                                _load_transactions_cached.clear()
+
                                 # データベースから再読み込みして即座に反映
                                 st.rerun()
 
@@ -443,10 +519,40 @@ with tab3:
     # 全取引一覧（参照用）
     st.markdown("---")
     st.markdown("### 📊 全取引一覧（参照用）")
-    display_df = filtered_df[["date", "category", "account_id", "holder", "description", "amount_out", "amount_in", "balance", "is_large", "is_transfer", "transfer_to"]].copy()
-    display_df.columns = ["日付", "分類", "口座ID", "名義人", "摘要", "払戻", "お預り", "残高", "多額取引", "資金移動", "移動先"]
+
+    # 全件をまとめてブラウザへ送らず、1ページ分だけシリアライズして描画する
+    # （Streamlitの転送コストは行数に比例するため、大きな通帳でも一定に保つ）
+    ref_page_size = 500
+    ref_total = len(filtered_df)
+    if ref_total > ref_page_size:
+        ref_total_pages = (ref_total - 1) // ref_page_size + 1
+        ref_page = st.number_input(
+            "ページ（参照用一覧）", min_value=1, max_value=ref_total_pages,
+            value=1, step=1, key="ref_page"
+        )
+        ref_start = (ref_page - 1) * ref_page_size
+        ref_end = min(ref_start + ref_page_size, ref_total)
+        st.caption(f"表示中: {ref_start + 1}～{ref_end}件 / 全{ref_total}件")
+        ref_df = filtered_df.iloc[ref_start:ref_end]
+    else:
+        ref_df = filtered_df
+
+    display_df = ref_df[["date", "category", "account_id", "holder", "description", "amount_out", "amount_in", "balance", "is_large", "is_transfer", "transfer_to"]].rename(columns={
+        "date": "日付", "category": "分類", "account_id": "口座ID", "holder": "名義人",
+        "description": "摘要", "amount_out": "払戻", "amount_in": "お預り", "balance": "残高",
+        "is_large": "多額取引", "is_transfer": "資金移動", "transfer_to": "移動先"
+    })
 
     st.dataframe(
         display_df,
         width="stretch"
     )
+
+with tab1:
+    _render_transfer_tab(df, is_transfer_mask)
+
+with tab2:
+    _render_large_tab(df, is_large_mask)
+
+with tab3:
+    _render_all_tab(df, categorized_mask)
@@ -3,6 +3,13 @@ import os
 import json
 from pathlib import Path
 
+# orjsonがあればJSONの読み書きに使う（C実装でstdlib jsonより数倍速い）
+# 必須依存にはしない：なければstdlibにフォールバックする
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 st.set_page_config(page_title="設定", page_icon="⚙️", layout="wide")
 
 st.title("⚙️ 設定")
@@ -13,15 +20,21 @@ CONFIG_FILE = Path(__file__).parent.parent / "data" / "user_settings.json"
 def load_settings():
     """設定ファイルから読み込み"""
     if CONFIG_FILE.exists():
-        with open(CONFIG_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
+        if orjson is not None:
+            return orjson.loads(CONFIG_FILE.read_bytes())
+        return json.loads(CONFIG_FILE.read_text(encoding="utf-8"))
     return {}
 
 def save_settings(settings):
     """設定ファイルに保存"""
     CONFIG_FILE.parent.mkdir(parents=True, exist_ok=True)
-    with open(CONFIG_FILE, "w", encoding="utf-8") as f:
-        json.dump(settings, f, ensure_ascii=False, indent=2)
+    if orjson is not None:
+        CONFIG_FILE.write_bytes(orjson.dumps(settings, option=orjson.OPT_INDENT_2))
+    else:
+        # チャンク書き出しのjson.dumpではなく、1回のシリアライズ＋1回の書き込みで済ませる
+        CONFIG_FILE.write_text(
+            json.dumps(settings, ensure_ascii=False, indent=2), encoding="utf-8"
+        )
 
 # 現在の設定を読み込み
 current_settings = load_settings()